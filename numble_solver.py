@@ -3,46 +3,102 @@
 Solve https://numble.wtf puzzles
 """
 
-from typing import Iterable, cast
-import itertools
+from operator import itemgetter
+from typing import Iterable
+import math
 import sys
 
+_OP_CODES = {'+': 1, '-': 2, '×': 3, '÷': 4}
 
-class Step:
-    """A step is a number and the calculation that produced it"""
 
-    def __init__(self, value: int, _left=None, _op=None, _right=None) -> None:
+class Step:  # pylint: disable=too-many-instance-attributes; half the attributes are deliberate caches
+    """
+    A step is a number and the calculation that produced it
+
+    Structurally equal steps always share a hash:
+
+    >>> left = Step(2) + Step(3)
+    >>> right = Step(3) + Step(2)
+    >>> left == right and hash(left) == hash(right)
+    True
+    """
+
+    __slots__ = ('value', 'left', 'op', 'right', '_hash', '_len', '_ops', '_str')
+
+    value: int
+    left: 'Step | None'
+    op: str | None
+    right: 'Step | None'
+    _hash: int
+    _len: int
+    _ops: 'tuple[int, int, int, int] | None'
+    _str: str | None
+
+    _interned: dict[int, 'Step'] = {}
+
+    def __new__(cls, value: int, _left=None, _op=None, _right=None) -> 'Step':
+        if _left is None:
+            # Leaves are pure values, so one instance per value serves every use
+            cached = cls._interned.get(value)
+
+            if cached is not None:
+                return cached
+
+        # Normalize the operand order of commutative operations so that a + b and
+        # b + a are the same step; value almost always settles the comparison
+        elif _op in ('+', '×') \
+                and (_left.value < _right.value or (_left.value == _right.value and _left < _right)):
+            _left, _right = _right, _left
+
+        self = super().__new__(cls)
         self.value = value
-        self.left: Step | None = _left
-        self.op: str | None = _op
-        self.right: Step | None = _right
-        self._normalize()
+        self.left = _left
+        self.op = _op
+        self.right = _right
+        self._str = None
+
+        # The operand hashes make this structural; the single hash() call mixes the
+        # fields at C speed, which measured faster than rotate-and-xor mixing in Python
+        self._hash = hash((value,
+                           0 if _op is None else _OP_CODES[_op],
+                           0 if _left is None else _left._hash,
+                           0 if _right is None else _right._hash))
+
+        if _left is None or _right is None:
+            self._len = 1
+            self._ops = (0, 0, 0, 0)
+        else:
+            self._len = _left._len + _right._len
+            # Computed lazily; most steps never reach the tie-break that needs it
+            self._ops = None
 
-    def _normalize(self) -> None:
-        if self.left is None or self.op is None or self.right is None:
-            return
+        if _left is None:
+            cls._interned[value] = self
 
-        if self.op in ('+', '×') and self.left < self.right:
-            self.left, self.right = self.right, self.left
+        return self
 
     def __eq__(self, other) -> bool:
+        if self is other:
+            return True
+
         if other is None:
             return False
 
-        return self.value == other.value \
-            and self.left == other.left \
+        return self._hash == other._hash \
+            and self.value == other.value \
             and self.op == other.op \
+            and self.left == other.left \
             and self.right == other.right
 
     def __hash__(self) -> int:
-        return hash((self.value, self.left, self.op, self.right))
+        return self._hash
 
     def __lt__(self, other) -> int:
         if self.value != other.value:
             return self.value < other.value
 
-        if len(self) != len(other):
-            return len(self) < len(other)
+        if self._len != other._len:
+            return self._len < other._len
 
         return self.operations() < other.operations()
 
@@ -51,34 +107,39 @@ class Step:
         Return the number of each operation in the step
         """
 
-        if self.left is None or self.op is None or self.right is None:
-            return (0, 0, 0, 0)
+        if self._ops is None:
+            if self.left is None or self.right is None:
+                return (0, 0, 0, 0)
 
-        div, mul, sub, add = [left + right for left, right in zip(self.left.operations(), self.right.operations())]
+            div, mul, sub, add = [left + right for left, right in
+                                  zip(self.left.operations(), self.right.operations())]
 
-        match self.op:
-            case '+':
-                add += 1
-            case '-':
-                sub += 1
-            case'×':
-                mul += 1
-            case '÷':
-                div += 1
+            match self.op:
+                case '+':
+                    add += 1
+                case '-':
+                    sub += 1
+                case'×':
+                    mul += 1
+                case '÷':
+                    div += 1
 
-        return (div, mul, sub, add)
+            self._ops = (div, mul, sub, add)
 
-    def __len__(self) -> int:
-        if self.left is None or self.op is None or self.right is None:
-            return 1
+        return self._ops
 
-        return len(self.left) + len(self.right)
+    def __len__(self) -> int:
+        return self._len
 
     def __str__(self) -> str:
         """Convert to a string using as few parentheses as possible"""
 
+        if self._str is not None:
+            return self._str
+
         if self.left is None or self.op is None or self.right is None:
-            return str(self.value)
+            self._str = str(self.value)
+            return self._str
 
         left_str = str(self.left)
         right_str = str(self.right)
@@ -89,7 +150,8 @@ class Step:
         if (self.op == '÷' and self.right.op is not None) or (self.op in ('×', '-') and self.right.op in ('+', '-')):
             right_str = f'({right_str})'
 
-        return f'{left_str} {self.op} {right_str}'
+        self._str = f'{left_str} {self.op} {right_str}'
+        return self._str
 
     def __add__(self, other):
         return Step(self.value + other.value, self, '+', other)
@@ -104,44 +166,152 @@ class Step:
         return Step(self.value // other.value, self, '÷', other)
 
 
-def operations(numbers: list[Step]) -> Iterable[Step]:
+def operations(numbers: list[tuple[int, int, Step]]) -> list[tuple[int, int, Step]]:
     """
-    Return the possible operations between all the Steps in a list
+    Return the possible operations between all the Steps in a list of
+    (slot, value, step) entries sorted ascending by value, as
+    (left slot, right slot, result) tuples
+
+    Duplicate numbers make some pairs structurally identical; each distinct pair is
+    only tried once.  This builds a list rather than yielding so the hot search loop
+    is not paying for a generator frame resume per operation.
     """
 
-    for left, right in itertools.combinations(numbers, 2):
-        yield left + right
+    results = []
+    seen: set[tuple[Step, Step]] = set()
+
+    for a, (i, left_value, left) in enumerate(numbers):
+        for j, right_value, right in numbers[a + 1:]:
+            pair = (left, right)
+
+            if pair in seen:
+                continue
+
+            seen.add(pair)
+            results.append((i, j, left + right))
+
+            # The sort order means left_value <= right_value, so there is no need to
+            # test each pair both ways round.  There is no need to multiply or divide
+            # by 1, no fractions, and Numble puzzles don't seem to use negative numbers
+            # as part of the solution while zero is no use
+            if left_value != 1:
+                results.append((i, j, left * right))
+
+                if right_value % left_value == 0:
+                    results.append((i, j, right / left))
 
-        # No need to multiply by 1
-        if left.value != 1 and right.value != 1:
-            yield left * right
+                if left_value == right_value:
+                    results.append((i, j, left / right))
 
-    for left, right in itertools.permutations(numbers, 2):
-        # Numble puzzles don't seem to use negative numbers as part of the solution and zero is no use
-        if left.value > right.value:
-            yield left - right
+            if left_value < right_value:
+                results.append((i, j, right - left))
 
-        # No need to divide by 1 and no fractions
-        if right.value != 1 and left.value % right.value == 0:
-            yield left / right
+    return results
 
 
-def solve(target: int, numbers: list[Step], results: set[Step]) -> None:
+def reachable_bound(numbers: Iterable[int]) -> int:
     """
-    Recursively solve a Numble puzzle
+    Return an upper bound on the values reachable from a set of numbers
+
+    Combining numbers `a` and `b` can produce at most `max(a, 2) × max(b, 2)`, so the
+    product of those factors bounds anything the whole set can reach.
     """
 
-    for replacement in operations(numbers):
-        if replacement.value == target:
-            results.add(replacement)
-        else:
-            if replacement.left is None or replacement.right is None:
-                raise ValueError('Invalid replacement')
+    return math.prod(max(n, 2) for n in numbers)
+
+
+# The state loop runs once per search state, so lookups are bound to locals and the
+# bit iteration is unfolded inline rather than split into tidier helpers
+def solve(target: int, start: Iterable[int]) -> Step | None:  # pylint: disable=too-many-locals,too-many-branches
+    """
+    Solve a Numble puzzle with an iterative depth-first search, returning the best
+    solution found or None if there is no solution
+
+    The working set of numbers is the bits of a mask over the shared `slots` list, so
+    replacing a pair is two bit flips rather than list removals.  A parallel `values`
+    list keeps each slot's plain integer value so the hot loops read ints rather than
+    Step attributes.  Each state's new step is written into its slot when the state is
+    popped; depth-first order guarantees the slot is not reused until the state's
+    subtree is finished.  Different orders of the same operations produce the same
+    multiset of steps, so states already seen in `visited` are skipped.  `bound` is the
+    reachable-value bound for the working set; branches that provably cannot reach
+    `target` are pruned, as are states that cannot use fewer numbers than the best
+    solution found so far.
+    """
+
+    best: Step | None = None
+    slots = [Step(n) for n in start]
+    values = [step.value for step in slots]
+    visited: set[tuple[Step, ...]] = set()
+    stack: list[tuple[int, int, Step | None]] = [((1 << len(slots)) - 1, reachable_bound(values), None)]
+
+    # Bind the hot lookups to locals; this loop runs for every state in the search
+    pop = stack.pop
+    push = stack.append
+    mark_visited = visited.add
+    by_value = itemgetter(1)
+
+    while stack:
+        mask, bound, step = pop()
+
+        if step is not None:
+            index = mask.bit_length() - 1
+
+            if index == len(slots):
+                slots.append(step)
+                values.append(step.value)
+            else:
+                slots[index] = step
+                values[index] = step.value
+
+        numbers = []
+        remaining = mask
+
+        while remaining:
+            low = remaining & -remaining
+            i = low.bit_length() - 1
+            numbers.append((i, values[i], slots[i]))
+            remaining ^= low
+
+        numbers.sort(key=by_value)
+        key = tuple(entry[2] for entry in numbers)
 
-            next_numbers = numbers + [replacement]
-            next_numbers.remove(replacement.left)
-            next_numbers.remove(replacement.right)
-            solve(target, next_numbers, results)
+        if key in visited:
+            continue
+
+        mark_visited(key)
+
+        # Any solution from here combines at least the two shortest steps, so if that
+        # is already longer than the best solution found this state cannot improve on it
+        if best is not None and len(numbers) > 1:
+            shortest = sorted(len(entry[2]) for entry in numbers)
+
+            if shortest[0] + shortest[1] > len(best):
+                continue
+
+        next_slot = 1 << mask.bit_length()
+
+        # A child state with a single number left would have no operations to try
+        fertile = len(numbers) > 2
+
+        for i, j, replacement in operations(numbers):
+            if replacement.value == target:
+                if best is None or replacement < best:
+                    best = replacement
+            elif fertile:
+                if replacement.left is None or replacement.right is None:
+                    raise ValueError('Invalid replacement')
+
+                next_bound = bound * max(replacement.value, 2) \
+                    // (max(replacement.left.value, 2) * max(replacement.right.value, 2))
+
+                if target > next_bound:
+                    continue
+
+                next_mask = (mask & ~((1 << i) | (1 << j))) | next_slot
+                push((next_mask, next_bound, replacement))
+
+    return best
 
 
 def solve_puzzle(target: int, numbers: list[int]) -> Step | None:
@@ -171,14 +341,7 @@ def solve_puzzle(target: int, numbers: list[int]) -> Step | None:
     if target in numbers:
         return Step(target)
 
-    results: set[Step] = set()
-
-    solve(target, [Step(n) for n in numbers], results)
-
-    if results:
-        return cast(list[Step], sorted(results))[0]
-
-    return None
+    return solve(target, numbers)
 
 
 def main() -> None: